@@ -6,11 +6,15 @@ import time
 import os
 import sys
 import io
+import gzip
 import uuid
 import random
+import traceback
 import pandas as pd
+import numpy as np
 import sqlite3
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timezone
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from collections import Counter
@@ -32,13 +36,20 @@ app = Flask(__name__)
 _scans = {}
 _scans_lock = threading.Lock()
 
+# Search autocomplete gets its own keep-alive session without urllib3 retries: mf.S retries with
+# backoff and sleeps out FMP's Retry-After on a 429, far past what a keystroke can wait for.
+_search_session = requests.Session()
+_search_session.headers.update(mf.S.headers)
+_search_session.mount("https://", HTTPAdapter(max_retries=0))
+
 
 # ── Routes ────────────────────────────────────────────────────────────────────
 
 @app.route("/")
 def index():
     api_key_present = bool(os.getenv("FMP_API_KEY"))
-    return render_template("index.html", api_key_present=api_key_present)
+    return render_template("index.html", api_key_present=api_key_present,
+                           country_tiers=mf.COUNTRY_TIERS)
 
 
 @app.route("/scan", methods=["POST"])
@@ -56,7 +67,9 @@ def start_scan():
 
     with _scans_lock:
         _scans[scan_id] = {"queue": q, "results": None, "error": None, "summary": None, "done": False,
-                           "created_at": time.time(), "cancelled": False}
+                           "created_at": time.time(), "cancelled": False,
+                           "ranked": None, "elapsed": None, "health_top_n": None,
+                           "payloads": {}, "csv": {}}
 
     t = threading.Thread(target=_run_scan, args=(scan_id, params, q, api_key), daemon=True)
     t.start()
@@ -100,9 +113,28 @@ def progress(scan_id):
                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
+def _requested_top_n():
+    """?top_n= clamped to the page's 10..100 range (it keys the per-scan memos); None when absent."""
+    top_n = request.args.get("top_n", type=int)
+    return None if top_n is None else min(max(top_n, 10), 100)
+
+
+def _beyond_health_checks(entry, top_n):
+    """409 response when top_n reaches past the candidates the scan health-checked, else None."""
+    checked = entry["health_top_n"]
+    if top_n and checked and top_n > checked:
+        return jsonify({"error": f"Health checks covered the top {checked} only; run a new scan for a larger Top N."}), 409
+    return None
+
+
 @app.route("/results/<scan_id>")
 def get_results(scan_id):
-    """Return the final ranked results as JSON once the scan is done."""
+    """Return the final ranked results as JSON once the scan is done.
+
+    ?top_n=N re-slices the scan's full ranking (with a matching summary)
+    instead of requiring a rescan when only the Top N setting changed.
+    Past the health-checked candidates it answers 409 instead.
+    """
     with _scans_lock:
         entry = _scans.get(scan_id)
     if not entry:
@@ -111,7 +143,21 @@ def get_results(scan_id):
         return jsonify({"error": "Scan not yet complete"}), 202
     if entry["error"]:
         return jsonify({"error": entry["error"]}), 500
-    return jsonify({"results": entry["results"]})
+    # Serialize once per scan and top_n; repeat fetches reuse the payload
+    top_n = _requested_top_n()
+    refused = _beyond_health_checks(entry, top_n)
+    if refused:
+        return refused
+    payload = entry["payloads"].get(top_n)
+    if payload is None:
+        if top_n and entry["ranked"] is not None:
+            final_df = entry["ranked"].head(top_n)
+            body = {"results": final_df.to_dict(orient="records"),
+                    "summary": _compute_summary(final_df, entry["elapsed"])}
+        else:
+            body = {"results": entry["results"]}
+        payload = entry["payloads"][top_n] = app.json.dumps(body)
+    return Response(payload, mimetype="application/json")
 
 
 @app.route("/download/<scan_id>")
@@ -122,15 +168,34 @@ def download_csv(scan_id):
     if not entry or not entry["done"] or not entry["results"]:
         return jsonify({"error": "No results available"}), 404
 
-    df = pd.DataFrame(entry["results"])
-    csv_bytes = df.to_csv(index=False).encode("utf-8")
+    # Encoded once per scan, top_n and encoding; repeat downloads reuse the bytes
+    top_n = _requested_top_n()
+    refused = _beyond_health_checks(entry, top_n)
+    if refused:
+        return refused
+    use_gzip = "gzip" in request.accept_encodings
+    csv_bytes = entry["csv"].get((top_n, use_gzip))
+    if csv_bytes is None:
+        if top_n and entry["ranked"] is not None:
+            df = entry["ranked"].head(top_n)
+        else:
+            df = pd.DataFrame(entry["results"])
+        csv_bytes = df.to_csv(index=False).encode("utf-8")
+        if use_gzip:
+            csv_bytes = gzip.compress(csv_bytes)
+        entry["csv"][(top_n, use_gzip)] = csv_bytes
+
     timestamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M")
-    return send_file(
+    resp = send_file(
         io.BytesIO(csv_bytes),
         mimetype="text/csv",
         as_attachment=True,
         download_name=f"magic_formula_{timestamp}.csv"
     )
+    if use_gzip:
+        resp.headers["Content-Encoding"] = "gzip"  # browser inflates it; the saved file is plain CSV
+    resp.vary.add("Accept-Encoding")
+    return resp
 
 # ── Single stock detail page — queries raw_json_vault and company_cache ──────
 @app.route("/stock/<ticker>")
@@ -211,8 +276,8 @@ def company_search(query):
         return jsonify([])
 
     try:
-        resp = requests.get(
-            "https://financialmodelingprep.com/api/v3/search",
+        resp = _search_session.get(
+            f"{mf.FMP_BASE}/search",
             params={"query": query, "limit": 10, "apikey": api_key},
             timeout=5
         )
@@ -601,31 +666,25 @@ def _push(q, msg: dict):
 def _sse(data: dict) -> str:
     return f"data: {json.dumps(data)}\n\n"
 
-def _compute_summary(results: list, elapsed: float) -> dict:
-    if not results:
+def _compute_summary(df: pd.DataFrame, elapsed: float) -> dict:
+    if df.empty:
         return {}
-    eys   = [r["EY"]  for r in results if r.get("EY")  is not None]
-    rocs  = [r["ROC"] for r in results if r.get("ROC") is not None]
-    mcaps = [r["marketCap"] for r in results if r.get("marketCap") is not None]
-    from collections import Counter
-    sectors = Counter(r.get("sector") or "Unknown" for r in results)
+    eys   = np.sort(df["EY"].dropna().to_numpy(dtype=float))
+    rocs  = np.sort(df["ROC"].dropna().to_numpy(dtype=float))
+    mcaps = np.sort(df["marketCap"].dropna().to_numpy(dtype=float))
+    sectors = Counter(df["sector"].fillna("").replace("", "Unknown"))
     minutes, seconds = divmod(int(elapsed), 60)
     return {
         "elapsed_str":    f"{minutes}m {seconds}s",
-        "count":          len(results),
-        "avg_ey":         round(sum(eys)  / len(eys)  * 100, 2) if eys  else None,
-        "avg_roc":        round(sum(rocs) / len(rocs) * 100, 2) if rocs else None,
-        "median_ey":      round(sorted(eys)[len(eys)   // 2] * 100, 2) if eys  else None,
-        "median_roc":     round(sorted(rocs)[len(rocs) // 2] * 100, 2) if rocs else None,
-        "max_ey":         round(max(eys)  * 100, 2) if eys  else None,
-        "max_roc":        round(max(rocs) * 100, 2) if rocs else None,
-        "median_mcap_b":  round(sorted(mcaps)[len(mcaps) // 2] / 1e9, 2) if mcaps else None,
+        "count":          len(df),
+        "avg_ey":         round(float(eys.mean())  * 100, 2) if eys.size  else None,
+        "avg_roc":        round(float(rocs.mean()) * 100, 2) if rocs.size else None,
+        "median_ey":      round(float(eys[eys.size   // 2]) * 100, 2) if eys.size  else None,
+        "median_roc":     round(float(rocs[rocs.size // 2]) * 100, 2) if rocs.size else None,
+        "max_ey":         round(float(eys[-1])  * 100, 2) if eys.size  else None,
+        "max_roc":        round(float(rocs[-1]) * 100, 2) if rocs.size else None,
+        "median_mcap_b":  round(float(mcaps[mcaps.size // 2]) / 1e9, 2) if mcaps.size else None,
         "top_sectors":    dict(sectors.most_common(5)),
-        "scatter": [
-            {"ticker": r["ticker"], "name": r.get("name", ""), "sector": r.get("sector", ""),
-             "ey": round(r["EY"] * 100, 2), "roc": round(r["ROC"] * 100, 2)}
-            for r in results if r.get("EY") is not None and r.get("ROC") is not None
-        ],
     }
 
 def _evict_old_scans(max_age_seconds=7200):
@@ -657,21 +716,24 @@ def _run_scan(scan_id: str, params: dict, q: queue.Queue, api_key: str):
         compute_f = params.get("compute_f", False)
 
         # Country filter
-        selected_countries = params.get("selected_countries", ["US"])
-        if not selected_countries:
-            selected_countries = ["US"]
+        selected_countries = frozenset(params.get("selected_countries") or ["US"])
 
         # ── Step 1: Gather symbols ─────────────────────────────────────────
         _push(q, {"type": "status", "message": "Gathering symbols from exchanges…", "step": 1})
 
         all_symbols = []
-        for ex in exchanges_list:
+        screener = {}  # symbol -> screener row, stands in for /profile
+        with ThreadPoolExecutor(max_workers=max(len(exchanges_list), 1)) as executor:
+            listings = [(ex, executor.submit(mf.list_symbols, ex, min_mcap, selected_countries, api_key=api_key))
+                        for ex in exchanges_list]
+        for ex, future in listings:
             try:
-                rows = mf.list_symbols(ex, min_mcap, selected_countries, api_key=api_key)
+                rows = future.result()
                 for r in rows:
                     sym = r.get("symbol")
                     if sym:
                         all_symbols.append(sym)
+                        screener.setdefault(sym, r)
             except Exception as e:
                 _push(q, {"type": "warning", "message": f"Error fetching symbols from {ex}: {e}"})
 
@@ -705,50 +767,95 @@ def _run_scan(scan_id: str, params: dict, q: queue.Queue, api_key: str):
         total = len(all_symbols)
         completed = 0
         skip_reasons = Counter()
+        last_push = 0.0
+
+        def tally(sym, rec):
+            nonlocal completed, skipped, filtered, qualified, last_push
+            completed += 1
+            if rec and rec.get("type") == "success" and rec.get("marketCap", 0) >= min_mcap:
+                records.append(rec)
+                qualified += 1
+            elif rec and rec.get("type") == "skip":
+                filtered += 1
+                skip_reasons[rec.get("reason", "Unknown")] += 1
+            else:
+                skipped += 1  # returned None — missing/incomplete data
+
+            # Throttle SSE traffic: every 25th symbol or 200ms, plus the final one
+            now = time.monotonic()
+            if completed % 25 and completed != total and now - last_push < 0.2:
+                return
+            last_push = now
+            _push(q, {
+                "type": "progress",
+                "symbol": sym,
+                "completed": completed,
+                "total": total,
+                "pct": round(completed / total * 100),
+                "skipped": skipped,
+                "filtered": filtered,
+                "qualified": qualified,
+            })
 
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            futures = {
-                executor.submit(mf.fetch_company_with_cache, sym, use_annual, include_goodwill,
-                                include_intangibles, compute_z, compute_f, api_key): sym
-                for sym in all_symbols
-            }
-            for future in as_completed(futures):
-                sym = futures[future]
-                completed += 1
-                pct = round(completed / total * 100)
+        # Fresh cached records (successes and skips) first in one batched lookup; only the misses hit FMP
+        period = mf._cache_period(use_annual, include_goodwill, include_intangibles, compute_z, compute_f)
+        cached = mf.db_fetch_many(all_symbols, period)
+        for sym, rec in cached.items():
+            tally(sym, rec)
+        to_fetch = [sym for sym in all_symbols if sym not in cached]
+
+        # Bulk endpoints next: a few downloads instead of 2-3 requests per symbol.
+        # Plans without bulk access raise here and we fall back to the per-symbol pool.
+        bulk = None
+        if to_fetch:
+            try:
+                bulk = mf.pull_company_bulk(to_fetch, use_annual, include_goodwill,
+                                            include_intangibles, compute_z, compute_f, api_key,
+                                            profiles=screener)
+            except Exception as e:
+                print(f"[_run_scan] bulk fetch unavailable, using per-symbol requests: {type(e).__name__}: {e}", flush=True)
+
+        # the bulk downloads can take a while; honor a Stop pressed meanwhile
+        if _scans[scan_id].get("cancelled"):
+            _push(q, {"type": "error", "message": "Scan cancelled."})
+            _finalize(scan_id, error="Cancelled")
+            return
 
+        if bulk is not None:
+            for sym in to_fetch:
                 if _scans[scan_id].get("cancelled"):
                     _push(q, {"type": "error", "message": "Scan cancelled."})
                     _finalize(scan_id, error="Cancelled")
                     return
+                if not mf._bulk_gap(bulk.get(sym)):
+                    tally(sym, bulk.get(sym))
+            # symbols the bulk files didn't fully cover get a per-symbol retry
+            to_fetch = [sym for sym in to_fetch if mf._bulk_gap(bulk.get(sym))]
+        if to_fetch:
+            # fetch the debt/revenue check's quarters up front so the health stage reuses them
+            history = debt_revenue_quarters if check_debt_revenue and not use_annual else 0
+            with ThreadPoolExecutor(max_workers=mf.FETCH_WORKERS) as executor:
+                futures = {
+                    executor.submit(mf.fetch_company_with_cache, sym, use_annual, include_goodwill,
+                                    include_intangibles, compute_z, compute_f, api_key,
+                                    min_mcap=min_mcap, prof=screener.get(sym),
+                                    history_quarters=history): sym
+                    for sym in to_fetch
+                }
+                for future in as_completed(futures):
+                    sym = futures[future]
+
+                    if _scans[scan_id].get("cancelled"):
+                        _push(q, {"type": "error", "message": "Scan cancelled."})
+                        _finalize(scan_id, error="Cancelled")
+                        return
 
-                try:
-                    rec = future.result(timeout=5)
-                    if rec and rec.get("type") == "success" and rec.get("marketCap", 0) >= min_mcap:
-                        records.append(rec)
-                        qualified += 1
-                    elif rec and rec.get("type") == "skip":
-                        filtered += 1
-                        skip_reasons[rec.get("reason", "Unknown")] += 1
-                    else:
-                        skipped += 1  # returned None — missing/incomplete data
-                except TimeoutError:
-                    print(f"[_run_scan] {sym}: timeout (worker exceeded 5s)", flush=True)
-                    skipped += 1
-                except Exception as e:
-                    print(f"[_run_scan] {sym}: {type(e).__name__}: {e}", flush=True)
-                    skipped += 1
-
-                _push(q, {
-                    "type": "progress",
-                    "symbol": sym,
-                    "completed": completed,
-                    "total": total,
-                    "pct": pct,
-                    "skipped": skipped,
-                    "filtered": filtered,
-                    "qualified": qualified,
-                })
+                    try:
+                        rec = future.result()  # already done — as_completed only yields finished futures
+                    except Exception as e:
+                        print(f"[_run_scan] {sym}: {type(e).__name__}: {e}", flush=True)
+                        rec = None
+                    tally(sym, rec)
 
         if not records:
             _push(q, {
@@ -760,7 +867,7 @@ def _run_scan(scan_id: str, params: dict, q: queue.Queue, api_key: str):
             return
 
         # ── Step 3: Rank ───────────────────────────────────────────────────
-        df = pd.DataFrame(records)
+        df = mf.records_frame(records, compute_z, compute_f)
         ranked = mf.magic_formula_rank(df)
         priority_cols = ["ticker", "name", "EY", "ROC", "exchange", "industry", "country", "MF_score"]
         remaining_cols = [c for c in ranked.columns if c not in priority_cols]
@@ -770,18 +877,16 @@ def _run_scan(scan_id: str, params: dict, q: queue.Queue, api_key: str):
         if check_debt_revenue or check_cashflow:
             _push(q, {"type": "status", "message": f"Running health checks on top {top_n} candidates…", "step": 4})
             top_candidates = ranked.head(top_n)
-            healthy_tickers = []
-            for ticker in top_candidates["ticker"]:
-                health = mf.check_financial_health(
-                    ticker,
-                    check_debt_revenue=check_debt_revenue,
-                    check_cashflow_quality=check_cashflow,
-                    debt_revenue_quarters=debt_revenue_quarters,
-                    cashflow_quarters=cashflow_quarters,
-                    api_key=api_key
-                )
-                if health["passes_all"]:
-                    healthy_tickers.append(ticker)
+            health_data = mf.fetch_health_data_many(
+                list(top_candidates["ticker"]),
+                check_debt_revenue=check_debt_revenue,
+                check_cashflow_quality=check_cashflow,
+                debt_revenue_quarters=debt_revenue_quarters,
+                cashflow_quarters=cashflow_quarters,
+                api_key=api_key
+            )
+            health = mf.evaluate_health_many(health_data, check_debt_revenue, check_cashflow)
+            healthy_tickers = {ticker for ticker, h in health.items() if h["passes_all"]}
             ranked = ranked[ranked["ticker"].isin(healthy_tickers)]
             _push(q, {"type": "status", "message": f"Health checks: {len(healthy_tickers)}/{len(top_candidates)} passed", "step": 4})
 
@@ -791,29 +896,36 @@ def _run_scan(scan_id: str, params: dict, q: queue.Queue, api_key: str):
             "marketCap", "EV", "EBIT", "EY", "ROC", "EY_rank", "ROC_rank", "MF_score", "ZScore", "FScore"
         ]
         display_cols = [c for c in display_cols if c in ranked.columns]
-        final_df = ranked[display_cols].head(top_n)
+        ranked = ranked[display_cols]
+        final_df = ranked.head(top_n)
 
         results = final_df.to_dict(orient="records")
 
         elapsed = time.time() - scan_start
-        summary = _compute_summary(results, elapsed)
-        _finalize(scan_id, results=results, summary=summary)
+        summary = _compute_summary(final_df, elapsed)
+        # Keep the full ranking so /results?top_n= can re-slice without rescanning;
+        # only the health-checked head of it is valid when health checks ran
+        _finalize(scan_id, results=results, summary=summary, ranked=ranked, elapsed=elapsed,
+                  health_top_n=top_n if (check_debt_revenue or check_cashflow) else None)
         _push(q, {"type": "done", "count": len(results), "total_analyzed": len(records), "summary": summary})
 
     except Exception as e:
-        import traceback
         tb = traceback.format_exc()
         print(tb, flush=True)  # or use logging
         _push(q, {"type": "error", "message": str(e)})
         _finalize(scan_id, error=str(e))
 
 
-def _finalize(scan_id: str, results=None, error=None, summary=None):
+def _finalize(scan_id: str, results=None, error=None, summary=None, ranked=None, elapsed=None,
+              health_top_n=None):
     with _scans_lock:
         if scan_id in _scans:
             _scans[scan_id]["results"] = results
             _scans[scan_id]["error"] = error
             _scans[scan_id]["summary"] = summary
+            _scans[scan_id]["ranked"] = ranked
+            _scans[scan_id]["elapsed"] = elapsed
+            _scans[scan_id]["health_top_n"] = health_top_n
             _scans[scan_id]["done"] = True
 
 
@@ -823,6 +935,10 @@ def _cleanup_loop():
     while True:
         time.sleep(3600)
         _evict_old_scans()
+        try:
+            mf.purge_http_cache()
+        except Exception as e:
+            print(f"[_cleanup_loop] purge_http_cache: {type(e).__name__}: {e}", flush=True)
 
 threading.Thread(target=_cleanup_loop, daemon=True).start()
 
@@ -2,11 +2,10 @@
 import json
 import sqlite3
 import time
-import pandas as pd
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from magicformula import list_symbols
-from magicformula import DB_PATH, fmp_get, _init_db, compute_mf_from_vault, magic_formula_rank, get_conn
+from magicformula import DB_PATH, fmp_get, _init_db, compute_mf_from_vault, magic_formula_rank, get_conn, records_frame
 # -------------------- Deep Scan --------------------
 
 
@@ -172,7 +171,7 @@ def run_mf_universe():
         return
 
     # Rank using existing magic_formula_rank
-    df = pd.DataFrame(records)
+    df = records_frame(records)
     ranked = magic_formula_rank(df)
 
     # Write to mf_universe
@@ -47,42 +47,54 @@ Run:
 """
 from __future__ import annotations
 import os, time, argparse
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterable, List, Optional
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
+import numpy as np
 import datetime
 import random
 import sqlite3
 import json
+import io
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from collections import deque
 import threading
+import logging
+
+log = logging.getLogger(__name__)
 
 #---filter dataset for actual active stock 
 
 
 #---rate limiter
 class RateLimiter:
-    """Simple per-minute rate limiter."""
-    def __init__(self, calls_per_minute=300):
+    """
+    Token-bucket rate limiter: up to `burst` calls back to back, then a steady refill.
+    Burst plus one minute of refill equals calls_per_minute, so no 60s window goes over.
+    """
+    def __init__(self, calls_per_minute=300, burst=None):
         self.calls_per_minute = calls_per_minute
-        self.window = 60.0
-        self.calls = deque()
+        self.capacity = burst if burst is not None else max(1, calls_per_minute // 10)
+        self.rate = max(calls_per_minute - self.capacity, 1) / 60.0  # tokens per second
+        self.tokens = float(self.capacity)
+        self.last = time.monotonic()
         self.lock = threading.Lock()
 
     def wait(self):
+        # reserve a token under the lock (going negative queues behind earlier callers),
+        # then sleep outside it so other threads can take their place in line
         with self.lock:
-            now = time.time()
-            # pop timestamps older than 60s
-            while self.calls and now - self.calls[0] > self.window:
-                self.calls.popleft()
-            if len(self.calls) >= self.calls_per_minute:
-                sleep_for = self.window - (now - self.calls[0]) + 0.01
-                if sleep_for > 0:
-                    time.sleep(sleep_for)
-            self.calls.append(time.time())
-limiter = RateLimiter(calls_per_minute=300)
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            sleep_for = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if sleep_for > 0:
+            time.sleep(sleep_for)
+# FMP Starter allows 300 calls/min; higher plans can raise this (and FMP_FETCH_WORKERS below)
+limiter = RateLimiter(calls_per_minute=int(os.getenv("FMP_CALLS_PER_MINUTE", "300")))
 
 try:
     from tqdm import tqdm  # progress bar (optional)
@@ -90,10 +102,28 @@ except Exception:  # pragma: no cover
     def tqdm(x, **_):
         return x
 
+try:
+    import orjson  # faster JSON for FMP responses and cache blobs (optional)
+    _json_loads = orjson.loads
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except Exception:  # pragma: no cover
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
 FMP_BASE = "https://financialmodelingprep.com/api/v3"
+FMP_BULK_BASE = "https://financialmodelingprep.com/api/v4"
 FMP_KEY  = os.getenv("FMP_API_KEY", "")
 
-EXCLUDE_SECTORS = {
+# Markets offered by the web UI's country picker and --tier1: tier -> [(label, FMP country code)]
+COUNTRY_TIERS = {
+    "Tier 1": [("USA", "US"), ("SGP", "SG"), ("GBR", "GB"), ("CAN", "CA")],
+    "Tier 2": [("AUS", "AU"), ("DEU", "DE"), ("FRA", "FR"), ("JPN", "JP")],
+    "Tier 3": [("HKG", "HK"), ("KOR", "KR"), ("IND", "IN"), ("CHN", "CN")],
+}
+
+# casefolded, so "financial services" from one feed matches "Financial Services" from another
+EXCLUDE_SECTORS = frozenset(s.casefold() for s in (
     "Financial Services",
     "Financial",
     "Banks",
@@ -102,17 +132,39 @@ EXCLUDE_SECTORS = {
     "Utility",
     "Real Estate",
     "Real Estate Investment Trust",
-    "REIT",}
+    "REIT",))
 
 # -------------------- HTTP helpers --------------------
 
+# Worker threads that share S; the connection pool is sized to match so every
+# worker keeps its own keep-alive connection instead of re-handshaking TLS.
+FETCH_WORKERS = int(os.getenv("FMP_FETCH_WORKERS", "16"))
+
 S = requests.Session()
 S.headers.update({"User-Agent": "MagicFormulaFMB/1.0"})
-
-def fmp_get(path: str, params: Optional[Dict[str, Any]] = None, retries: int = 3, backoff: float = 0.8, api_key: str = None):
+# Transient failures (429 / 5xx / dropped connections) are retried by urllib3 with exponential
+# backoff, honoring FMP's Retry-After; after the last attempt the error response is returned
+# so raise_for_status() still surfaces it as an HTTPError.
+FMP_RETRY = Retry(total=3, backoff_factor=0.8, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET"]), respect_retry_after_header=True, raise_on_status=False)
+S.mount("https://", HTTPAdapter(max_retries=FMP_RETRY, pool_connections=FETCH_WORKERS, pool_maxsize=FETCH_WORKERS))
+
+# Raw statements change at most quarterly, so cache the HTTP responses for a week.
+# Company records built from them can then be recomputed without touching the API.
+HTTP_CACHE_DAYS = 7
+
+def fmp_get(path: str, params: Optional[Dict[str, Any]] = None, api_key: str = None, cache_days: float = 0):
+    """GET a v3 endpoint. With cache_days, a response stored in http_cache within that many days is reused."""
     if params is None:
         params = {}
 
+    cache_key = None
+    if cache_days:
+        cache_key = path + "?" + "&".join(f"{k}={params[k]}" for k in sorted(params))
+        cached = http_cache_get(cache_key, cache_days)
+        if cached is not None:
+            return cached
+
     if not api_key:
         api_key = os.getenv("FMP_API_KEY", "")
     if not api_key:
@@ -120,23 +172,130 @@ def fmp_get(path: str, params: Optional[Dict[str, Any]] = None, retries: int = 3
  
     params = dict(params)
     params["apikey"] = api_key
-    url = f"{FMP_BASE}{path}"
-    for a in range(retries):
-        limiter.wait()  # reuse your existing RateLimiter
-        r = S.get(url, params=params, timeout=5)
-        if r.status_code == 429:
-            time.sleep(backoff * (a + 1))
-            continue
-        r.raise_for_status()
-        return r.json()
-    raise requests.HTTPError(f"Failed after retries: {url}")
+    limiter.wait()
+    r = S.get(f"{FMP_BASE}{path}", params=params, timeout=5)
+    r.raise_for_status()
+    data = _json_loads(r.content)
+    if cache_key and data:
+        http_cache_put(cache_key, data)
+    return data
+
+# API key -> time.monotonic() when FMP refused it a bulk endpoint (plan tier). Scans with that
+# key go straight to per-symbol requests for a while; other keys are unaffected.
+_bulk_unavailable: Dict[str, float] = {}
+BULK_UNAVAILABLE_TTL = 6 * 3600
+
+def fmp_get_bulk(path: str, params: Optional[Dict[str, Any]] = None, api_key: str = None,
+                 wanted: Optional[set] = None) -> List[Dict[str, Any]]:
+    """
+    GET a v4 bulk endpoint (CSV, every ticker in one response) and return its rows,
+    only those for `wanted` symbols when given (filtered before building Python dicts).
+    Keys are normalized to the v3 JSON spelling ("Symbol" -> "symbol", "MktCap" -> "mktCap")
+    and blank cells come back as None.
+    """
+    params = dict(params or {})
+    params["apikey"] = api_key or os.getenv("FMP_API_KEY", "")
+    if not params["apikey"]:
+        raise RuntimeError("FMP_API_KEY not set. Provide it directly or set FMP_API_KEY environment variable")
+
+    refused_at = _bulk_unavailable.get(params["apikey"])
+    if refused_at is not None and time.monotonic() - refused_at < BULK_UNAVAILABLE_TTL:
+        raise RuntimeError("FMP bulk endpoints not available on this plan")
+
+    limiter.wait()
+    r = S.get(f"{FMP_BULK_BASE}{path}", params=params, timeout=120)
+    # 402/403 = plan without bulk access; 401 is a bad key, which says nothing about the plan
+    if r.status_code in (402, 403):
+        _bulk_unavailable[params["apikey"]] = time.monotonic()
+    r.raise_for_status()
+    if not r.text.strip():
+        return []
+
+    df = pd.read_csv(io.StringIO(r.text), keep_default_na=False, na_values=[""], low_memory=False)
+    df.columns = [c[:1].lower() + c[1:] for c in df.columns]
+    if wanted is not None and "symbol" in df.columns:
+        df = df[df["symbol"].isin(wanted)]
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict(orient="records")
+
+def _group_by_symbol(rows: List[Dict[str, Any]], wanted: set) -> Dict[str, List[Dict[str, Any]]]:
+    """Bucket bulk statement rows per symbol, newest first (same order as the per-ticker endpoints)."""
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for r in rows:
+        sym = r.get("symbol")
+        if sym in wanted:
+            out.setdefault(sym, []).append(r)
+    for items in out.values():
+        items.sort(key=lambda q: str(q.get("date") or ""), reverse=True)
+    return out
+
+def _bulk_statements(endpoint: str, wanted: set, annual: bool = False,
+                     api_key: str = None) -> Dict[str, List[Dict[str, Any]]]:
+    period = "annual" if annual else "quarter"
+    this_year = datetime.date.today().year
+    # Early in a calendar year the current year has no filings and last year's Q4 / annual
+    # report may not be out yet, so reach back far enough that 4 quarters (quarterly) or
+    # 2 annual periods (metrics + the prior year F-score needs) are still covered.
+    rows = []
+    for y in range(this_year, this_year - (4 if annual else 3), -1):
+        rows.extend(fmp_get_bulk(f"/{endpoint}-bulk", {"year": y, "period": period}, api_key=api_key,
+                                 wanted=wanted))
+    return _group_by_symbol(rows, wanted)
+
+def fmp_bulk_profiles(wanted: set, api_key: str = None) -> Dict[str, Dict[str, Any]]:
+    return {r["symbol"]: r for r in fmp_get_bulk("/profile/all", api_key=api_key, wanted=wanted)}
+
+def fmp_bulk_income(wanted: set, annual: bool = False, api_key: str = None) -> Dict[str, List[Dict[str, Any]]]:
+    return _bulk_statements("income-statement", wanted, annual, api_key)
+
+def fmp_bulk_balance(wanted: set, api_key: str = None) -> Dict[str, List[Dict[str, Any]]]:
+    # quarterly in annual mode too, like fmp_balance: metrics use the latest balance sheet
+    return _bulk_statements("balance-sheet-statement", wanted, False, api_key)
+
+def fmp_bulk_cashflow(wanted: set, annual: bool = False, api_key: str = None) -> Dict[str, List[Dict[str, Any]]]:
+    return _bulk_statements("cash-flow-statement", wanted, annual, api_key)
 
 
 # -------------------- Data pulling --------------------
 
-def list_symbols(ex: str, min_mcap: float = 50e6, countries: List[str] = None, api_key: str = None) -> List[Dict[str, Any]]:
-    """Return only active US common stocks above min_mcap."""
-    
+# warrant / unit / preferred share-class suffixes that list_symbols drops
+_BAD_SUFFIXES = ("WT", "WS", "PR")
+
+# exchange -> (time.monotonic() at which the rows were fetched from FMP, rows); saves
+# re-parsing the symbol_cache blob on every scan within the same process
+_screener_memo: Dict[str, tuple] = {}
+_screener_memo_lock = threading.Lock()
+SCREENER_MEMO_MAX = 64
+
+def _screener_rows(ex: str, api_key: str = None, max_age_hours: float = 1) -> List[Dict[str, Any]]:
+    """Raw /stock-screener rows for one exchange, served from memory or symbol_cache when fresh."""
+    with _screener_memo_lock:
+        hit = _screener_memo.get(ex)
+    if hit and time.monotonic() - hit[0] < max_age_hours * 3600:
+        return hit[1]
+
+    rows, age = _screener_rows_db(ex, api_key, max_age_hours)
+    if not rows:
+        return rows  # don't pin an empty/failed response for the whole max age
+    with _screener_memo_lock:
+        # age the memo entry from the symbol_cache row, so memory + DB never exceed max_age_hours
+        _screener_memo[ex] = (time.monotonic() - age, rows)
+        while len(_screener_memo) > SCREENER_MEMO_MAX:
+            _screener_memo.pop(next(iter(_screener_memo)))
+    return rows
+
+def _screener_rows_db(ex: str, api_key: str = None, max_age_hours: float = 1) -> tuple:
+    """(rows, age in seconds) from symbol_cache when fresh, else from /stock-screener (age 0)."""
+    conn = get_conn()
+    row = conn.execute(
+        "SELECT json_blob, (julianday('now') - julianday(last_updated)) * 86400 FROM symbol_cache "
+        "WHERE exchange = ? AND last_updated > datetime('now', ?)",
+        (ex, f'-{max_age_hours} hours')
+    ).fetchone()
+    conn.close()
+    if row:
+        return _json_loads(row[0]), max(row[1] or 0.0, 0.0)
+
     rows = fmp_get(
     "/stock-screener",
     {
@@ -148,137 +307,215 @@ def list_symbols(ex: str, min_mcap: float = 50e6, countries: List[str] = None, a
     },
     api_key=api_key
     ) or []
-    
-    filtered = []
-    for r in rows:
-        sym = r.get("symbol")
-        mcap = r.get("marketCap") or 0
-
-        # --- filter out ETFs, funds, warrants, preferreds stocks, SPACs, microcaps ---
-        if (
-            sym
-            and isinstance(sym, str)
-            and (countries is None or r.get("country") in countries)
-            and not any(sym.endswith(x) for x in ("WT", "WS", "PR"))
-            and "-" not in sym
-            and sym.isalpha()
-            and len(sym) <= 5
-            and mcap >= min_mcap
-        ):
-            filtered.append(r)
-
-    return filtered
+
+    if rows:
+        conn = get_conn()
+        conn.execute("""
+            INSERT INTO symbol_cache (exchange, json_blob)
+            VALUES (?, ?)
+            ON CONFLICT(exchange) DO UPDATE SET
+                json_blob = excluded.json_blob,
+                last_updated = CURRENT_TIMESTAMP
+        """, (ex, _json_dumps(rows)))
+        conn.commit()
+        conn.close()
+    return rows, 0.0
+
+def list_symbols(ex: str, min_mcap: float = 50e6, countries: Iterable[str] = None, api_key: str = None,
+                 max_age_hours: float = 1) -> List[Dict[str, Any]]:
+    """Return only active US common stocks above min_mcap.
+
+    The unfiltered screener response is cached per exchange for max_age_hours,
+    so min_mcap/countries changes between runs don't cost another API call.
+    """
+    rows = _screener_rows(ex, api_key=api_key, max_age_hours=max_age_hours)
+    if countries is not None and not isinstance(countries, frozenset):
+        countries = frozenset(countries)
+
+    if not rows:
+        return []
+    df = pd.DataFrame.from_records(rows, columns=["symbol", "country", "marketCap"])
+
+    # --- filter out ETFs, funds, warrants, preferreds stocks, SPACs, microcaps ---
+    sym = df["symbol"].where(df["symbol"].map(type) == str).astype("string")
+    mask = (
+        sym.str.isalpha().fillna(False)
+        & (sym.str.len() <= 5).fillna(False)
+        & ~sym.str.endswith(_BAD_SUFFIXES).fillna(False)
+        & (pd.to_numeric(df["marketCap"], errors="coerce").fillna(0) >= min_mcap)
+    )
+    if countries is not None:
+        mask &= df["country"].isin(countries)
+
+    return [rows[i] for i in np.flatnonzero(mask.to_numpy(dtype=bool))]
 
 def fmp_profile(ticker: str, api_key: str = None) -> Dict[str, Any]:
     prof = fmp_get(f"/profile/{ticker}", api_key=api_key) or []
     return prof[0] if isinstance(prof, list) and prof else {}
 
 
-def fmp_income(ticker: str, annual: bool = False, api_key: str = None) -> List[Dict[str, Any]]:
+def fmp_income(ticker: str, annual: bool = False, api_key: str = None, limit: int = 4) -> List[Dict[str, Any]]:
     if annual:
-        return fmp_get(f"/income-statement/{ticker}", {"period": "annual", "limit": 2}, api_key=api_key) or []
-    return fmp_get(f"/income-statement/{ticker}", {"period": "quarter", "limit": 4}, api_key=api_key) or []
+        return fmp_get(f"/income-statement/{ticker}", {"period": "annual", "limit": 2}, api_key=api_key,
+                       cache_days=HTTP_CACHE_DAYS) or []
+    return fmp_get(f"/income-statement/{ticker}", {"period": "quarter", "limit": limit}, api_key=api_key,
+                   cache_days=HTTP_CACHE_DAYS) or []
 
-def fmp_balance(ticker: str, api_key: str = None) -> List[Dict[str, Any]]:
-    return fmp_get(f"/balance-sheet-statement/{ticker}", {"period": "quarter", "limit": 2}, api_key=api_key) or []
+def fmp_balance(ticker: str, api_key: str = None, limit: int = 2) -> List[Dict[str, Any]]:
+    return fmp_get(f"/balance-sheet-statement/{ticker}", {"period": "quarter", "limit": limit}, api_key=api_key,
+                   cache_days=HTTP_CACHE_DAYS) or []
 
 def fmp_cashflow(ticker: str, annual: bool = False, api_key: str = None) -> List[Dict[str, Any]]:
     limit = 2 if annual else 8
     period = "annual" if annual else "quarter"
-    return fmp_get(f"/cash-flow-statement/{ticker}", {"period": period, "limit": limit}, api_key=api_key) or []
+    return fmp_get(f"/cash-flow-statement/{ticker}", {"period": period, "limit": limit}, api_key=api_key,
+                   cache_days=HTTP_CACHE_DAYS) or []
 
-def check_financial_health(symbol: str,
+def fetch_health_data(symbol: str,
     check_debt_revenue: bool = False,
     check_cashflow_quality: bool = False,
     debt_revenue_quarters: int = 6,
     cashflow_quarters: int = 8,
     api_key: str = None) -> dict:
     """
-    Optional health checks.
-    Returns dict with pass/fail for each enabled check.
+    Network half of the health checks: the raw quarterly statements each enabled check needs.
+    Returns {"bs": [...], "is": [...], "cf": [...]}; a failed fetch leaves its keys as None.
     """
-    results = {"symbol": symbol, "passes_all": True}
-    
-    # Check 1: D/E decreasing while revenue increasing
+    data = {"bs": None, "is": None, "cf": None}
     if check_debt_revenue:
         try:
-            bs_data = fmp_get(f"/balance-sheet-statement/{symbol}", 
-                             {"period": "quarter", "limit": debt_revenue_quarters}, api_key=api_key)
-            is_data = fmp_get(f"/income-statement/{symbol}", 
-                             {"period": "quarter", "limit": debt_revenue_quarters}, api_key=api_key)
-            
-            if bs_data and is_data and len(bs_data) >= 3 and len(is_data) >= 3:
-                # Calculate D/E ratios (oldest to newest)
-                de_ratios = []
-                for q in reversed(bs_data):
-                    equity = q.get("totalStockholdersEquity") or 0
-                    debt = q.get("totalDebt") or 0
-                    de_ratios.append(debt / equity if equity > 0 else float('inf'))
-                
-                revenues = [q.get("revenue") or 0 for q in reversed(is_data)]
-                
-                # Check trend: D/E should trend down, revenue should trend up
-                de_decreasing = all(de_ratios[i] >= de_ratios[i+1] for i in range(len(de_ratios)-1))
-                rev_increasing = all(revenues[i] <= revenues[i+1] for i in range(len(revenues)-1))
-                
-                results["debt_revenue_check"] = de_decreasing and rev_increasing
-            else:
-                results["debt_revenue_check"] = None  # Insufficient data
+            data["bs"] = fmp_get(f"/balance-sheet-statement/{symbol}",
+                                 {"period": "quarter", "limit": debt_revenue_quarters}, api_key=api_key,
+                                 cache_days=HTTP_CACHE_DAYS)
+            data["is"] = fmp_get(f"/income-statement/{symbol}",
+                                 {"period": "quarter", "limit": debt_revenue_quarters}, api_key=api_key,
+                                 cache_days=HTTP_CACHE_DAYS)
         except Exception as e:
-            print(f"[check_financial_health] {symbol} debt/revenue check: {type(e).__name__}: {e}", flush=True)
-            results["debt_revenue_check"] = None
-        
-        if results.get("debt_revenue_check") is False:
-            results["passes_all"] = False
-    
-    # Check 2: OCF > Net Income for consecutive quarters
+            print(f"[fetch_health_data] {symbol} debt/revenue data: {type(e).__name__}: {e}", flush=True)
+            data["bs"] = data["is"] = None
     if check_cashflow_quality:
         try:
-            cf_data = fmp_get(f"/cash-flow-statement/{symbol}", 
-                             {"period": "quarter", "limit": cashflow_quarters}, api_key=api_key)
-            
-            if cf_data and len(cf_data) >= 4:
-                ocf_beats_ni = all(
-                    (q.get("operatingCashFlow") or 0) > (q.get("netIncome") or 0)
-                    for q in cf_data
-                )
-                results["cashflow_quality_check"] = ocf_beats_ni
-            else:
-                results["cashflow_quality_check"] = None
+            data["cf"] = fmp_get(f"/cash-flow-statement/{symbol}",
+                                 {"period": "quarter", "limit": cashflow_quarters}, api_key=api_key,
+                                 cache_days=HTTP_CACHE_DAYS)
         except Exception as e:
-            print(f"[check_financial_health] {symbol} cashflow check: {type(e).__name__}: {e}", flush=True)
-            results["cashflow_quality_check"] = None
-        
-        if results.get("cashflow_quality_check") is False:
-            results["passes_all"] = False
-    
-    return results
+            print(f"[fetch_health_data] {symbol} cashflow data: {type(e).__name__}: {e}", flush=True)
+    return data
 
-def _latest(items: List[Dict[str, Any]], field: str):
-    if not items:
-        return None
-    v = items[0].get(field)
-    return None if v in (None, "") else float(v)
+def fetch_health_data_many(symbols: List[str],
+    check_debt_revenue: bool = False,
+    check_cashflow_quality: bool = False,
+    debt_revenue_quarters: int = 6,
+    cashflow_quarters: int = 8,
+    api_key: str = None,
+    max_workers: int = FETCH_WORKERS) -> Dict[str, dict]:
+    """fetch_health_data for every symbol concurrently; {symbol: data} in input order."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_health_data, sym, check_debt_revenue, check_cashflow_quality,
+                                   debt_revenue_quarters, cashflow_quarters, api_key)
+                   for sym in symbols]
+        return {sym: f.result() for sym, f in zip(symbols, futures)}
+
+def _statements_long(health_data: Dict[str, dict], key: str, fields: List[str]) -> pd.DataFrame:
+    """
+    One long frame of every symbol's `key` statements: columns symbol, pos (0 = newest), *fields.
+    Missing/None values become 0.
+    """
+    rows = [
+        (sym, pos, *(q.get(f) for f in fields))
+        for sym, data in health_data.items()
+        if isinstance(data.get(key), list)
+        for pos, q in enumerate(data[key])
+    ]
+    df = pd.DataFrame(rows, columns=["symbol", "pos", *fields])
+    df[fields] = df[fields].apply(pd.to_numeric, errors="coerce").fillna(0.0).astype("float64")
+    return df.sort_values(["symbol", "pos"], kind="stable")
 
-def _first_available(items: List[Dict[str, Any]], fields: List[str]):
-    if not items:
-        return None
-    for f in fields:
-        v = items[0].get(f)
-        if v not in (None, ""):
-            try:
-                return float(v)
-            except Exception:
-                return None
-    return None
+def evaluate_health_many(health_data: Dict[str, dict],
+    check_debt_revenue: bool = False,
+    check_cashflow_quality: bool = False) -> Dict[str, dict]:
+    """
+    Optional health checks for many symbols at once ({symbol: data} from fetch_health_data_many),
+    computed with NumPy passes over long-format statement frames instead of a per-ticker loop (no network I/O).
+    Returns {symbol: {"symbol", "passes_all", <check>: True/False/None per enabled check}} in input order;
+    None means insufficient data and doesn't fail passes_all.
+    """
+    results = {sym: {"symbol": sym, "passes_all": True} for sym in health_data}
+
+    def all_per_symbol(df: pd.DataFrame, ok: np.ndarray, min_rows: int) -> pd.Series:
+        # np.all of ok over each symbol's run of rows (df is sorted by symbol); NaN under min_rows rows
+        sym = df["symbol"].to_numpy()
+        if not len(sym):
+            return pd.Series(dtype=object)
+        starts = np.flatnonzero(np.r_[True, sym[1:] != sym[:-1]])
+        sizes = np.diff(np.r_[starts, len(sym)])
+        return pd.Series(np.logical_and.reduceat(ok, starts), index=sym[starts]).where(sizes >= min_rows)
+
+    def trend_ok(df: pd.DataFrame, col: str, older_ge: bool, min_rows: int) -> pd.Series:
+        # rows are newest-first per symbol; compare each period with the one before it pairwise
+        # (not np.diff, which turns inf - inf into nan); pairs straddling two symbols pass
+        v, sym = df[col].to_numpy(), df["symbol"].to_numpy()
+        ok = np.ones(len(v), dtype=bool)
+        ok[:-1] = ((v[1:] >= v[:-1]) if older_ge else (v[1:] <= v[:-1])) | (sym[1:] != sym[:-1])
+        return all_per_symbol(df, ok, min_rows)
 
-def _sum_ttm(items: List[Dict[str, Any]], field: str, start_idx: int = 0) -> float:
-    try:
-        return sum(float(q.get(field) or 0) for q in items[start_idx:start_idx+4])
-    except Exception:
-        return 0.0
+    # Check 1: D/E decreasing while revenue increasing
+    if check_debt_revenue:
+        bs = _statements_long(health_data, "bs", ["totalDebt", "totalStockholdersEquity"])
+        inc = _statements_long(health_data, "is", ["revenue"])
+        equity = bs["totalStockholdersEquity"].to_numpy()
+        bs["de"] = np.divide(bs["totalDebt"].to_numpy(), equity,
+                             out=np.full(len(bs), np.inf), where=equity > 0)
+        de_ok = trend_ok(bs, "de", older_ge=True, min_rows=3)
+        rev_ok = trend_ok(inc, "revenue", older_ge=False, min_rows=3)
+        for sym, res in results.items():
+            de, rev = de_ok.get(sym), rev_ok.get(sym)
+            res["debt_revenue_check"] = None if pd.isna(de) or pd.isna(rev) else bool(de and rev)
+
+    # Check 2: OCF > Net Income for consecutive quarters
+    if check_cashflow_quality:
+        cf = _statements_long(health_data, "cf", ["operatingCashFlow", "netIncome"])
+        cf_ok = all_per_symbol(cf, cf["operatingCashFlow"].to_numpy() > cf["netIncome"].to_numpy(), 4)
+        for sym, res in results.items():
+            v = cf_ok.get(sym)
+            res["cashflow_quality_check"] = None if pd.isna(v) else bool(v)
+
+    for res in results.values():
+        if res.get("debt_revenue_check") is False or res.get("cashflow_quality_check") is False:
+            res["passes_all"] = False
+    return results
+
+def check_financial_health(symbol: str,
+    check_debt_revenue: bool = False,
+    check_cashflow_quality: bool = False,
+    debt_revenue_quarters: int = 6,
+    cashflow_quarters: int = 8,
+    api_key: str = None) -> dict:
+    """Fetch + evaluate the optional health checks for a single symbol."""
+    data = fetch_health_data(symbol, check_debt_revenue, check_cashflow_quality,
+                             debt_revenue_quarters, cashflow_quarters, api_key)
+    return evaluate_health_many({symbol: data}, check_debt_revenue, check_cashflow_quality)[symbol]
+
+def _market_cap(prof: dict) -> float:
+    """Profile (mktCap) or screener (marketCap) market cap; NaN when missing or not a number."""
+    v = prof.get("mktCap")
+    if v is None:
+        v = prof.get("marketCap")
+    return float(pd.to_numeric(v, errors="coerce"))
+
+def _num(d: Dict[str, Any], field: str) -> Optional[float]:
+    """Statement field as float, or None when FMP left it missing/blank."""
+    v = d.get(field)
+    return None if v in (None, "") else float(v)
 
 # -------------------- Field helpers --------------------
+def _is_excluded(prof: dict) -> bool:
+    """Excluded sector or a preferred/series share class; works on a profile or a screener row."""
+    if (prof.get("sector") or "").casefold() in EXCLUDE_SECTORS:
+        return True
+    name = (prof.get("companyName") or "").lower()
+    return any(x in name for x in ["preferred", "perpetual", "series a", "series b"])
+
 def _compute_mf_metrics(prof: dict, inc: list, bal: list, annual: bool, include_goodwill: bool = False,
                             include_intangibles: bool = False) -> Optional[Dict[str, Any]]:
     """
@@ -287,30 +524,28 @@ def _compute_mf_metrics(prof: dict, inc: list, bal: list, annual: bool, include_
     """
     company_name = prof.get("companyName") or prof.get("company") or prof.get("symbol", "")
 
-    if prof.get("sector") in EXCLUDE_SECTORS:
+    if _is_excluded(prof):
         return None
 
-    name = prof.get("companyName", "").lower()
-    if any(x in name for x in ["preferred", "perpetual", "series a", "series b"]):
-        return None
+    i0 = inc[0] if inc else {}
+    b0 = bal[0] if bal else {}
 
     if annual:
-        ebit = _latest(inc, "operatingIncome")
+        ebit = _num(i0, "operatingIncome")
     elif inc and len(inc) >= 4:
         ebit = sum(q.get("operatingIncome") or 0 for q in inc[:4])
     else:
         ebit = None
 
-    tca  = _latest(bal, "totalCurrentAssets")
-    tcl  = _latest(bal, "totalCurrentLiabilities")
-    ppe  = _latest(bal, "propertyPlantEquipmentNet")
-    cash = _latest(bal, "cashAndShortTermInvestments")
-    debt = _first_available(bal, ["totalDebt", "shortTermDebt", "longTermDebt"]) or 0.0
+    tca  = _num(b0, "totalCurrentAssets")
+    tcl  = _num(b0, "totalCurrentLiabilities")
+    ppe  = _num(b0, "propertyPlantEquipmentNet")
+    cash = _num(b0, "cashAndShortTermInvestments")
+    debt = next((_num(b0, f) for f in ("totalDebt", "shortTermDebt", "longTermDebt")
+                 if b0.get(f) not in (None, "")), None) or 0.0
 
-    mcap = prof.get("mktCap") if prof.get("mktCap") is not None else prof.get("marketCap")
-    try:
-        mcap = float(mcap) if mcap is not None else None
-    except Exception:
+    mcap = _market_cap(prof)
+    if np.isnan(mcap):
         mcap = None
 
     if None in (ebit, tca, tcl, ppe, cash, mcap):
@@ -322,8 +557,8 @@ def _compute_mf_metrics(prof: dict, inc: list, bal: list, annual: bool, include_
 
     nwc = (tca - cash) - (tcl - debt)
     nwc = max(nwc, 0)
-    goodwill = _latest(bal, "goodwill") or 0
-    intangibles = _latest(bal, "intangibleAssets") or 0
+    goodwill = _num(b0, "goodwill") or 0
+    intangibles = _num(b0, "intangibleAssets") or 0
     if not include_goodwill:
         goodwill = 0
     if not include_intangibles:
@@ -367,6 +602,98 @@ def _compute_mf_metrics(prof: dict, inc: list, bal: list, annual: bool, include_
         "Intangibles": intangibles,
     }
 
+_MF_BAL_FIELDS = ["totalCurrentAssets", "totalCurrentLiabilities", "propertyPlantEquipmentNet",
+                  "cashAndShortTermInvestments", "totalDebt", "shortTermDebt", "longTermDebt",
+                  "goodwill", "intangibleAssets"]
+
+def _mf_metrics_frame(symbols: List[str], profiles: Dict[str, dict], inc_by_sym: Dict[str, list],
+                      bal_by_sym: Dict[str, list], annual: bool, include_goodwill: bool = False,
+                      include_intangibles: bool = False) -> pd.DataFrame:
+    """
+    Column-wise _compute_mf_metrics for many companies at once (the bulk path).
+    Returns one row per symbol that has a profile and isn't excluded, indexed by symbol,
+    with the metric columns plus 'reason' (None for companies that pass).
+    """
+    syms = [s for s in symbols if profiles.get(s)]
+    prof = pd.DataFrame.from_records([profiles[s] for s in syms], index=syms,
+                                     columns=["companyName", "company", "symbol", "mktCap", "marketCap",
+                                              "exchangeShortName", "country", "sector", "industry"]).astype(object)
+    keep = ~prof["sector"].astype("string").str.casefold().isin(EXCLUDE_SECTORS).fillna(False).astype(bool)
+    lname = prof["companyName"].fillna("").astype(str).str.lower()
+    keep &= ~lname.str.contains("preferred|perpetual|series a|series b", regex=True)
+    prof = prof[keep]
+    syms = prof.index.tolist()
+
+    def num(s):
+        return pd.to_numeric(s, errors="coerce").astype("float64")
+
+    # latest balance sheet per symbol
+    bal = pd.DataFrame.from_records([bal_by_sym[s][0] for s in syms if bal_by_sym.get(s)],
+                                    index=[s for s in syms if bal_by_sym.get(s)], columns=_MF_BAL_FIELDS)
+    bal = bal.apply(num).astype("float64").reindex(syms)
+
+    # EBIT: latest annual, or the sum of the last four quarters (missing quarters count as 0)
+    if annual:
+        ebit = num(pd.Series({s: inc_by_sym[s][0].get("operatingIncome") for s in syms if inc_by_sym.get(s)},
+                             dtype=object)).reindex(syms)
+    else:
+        flat = [(s, q.get("operatingIncome")) for s in syms if len(inc_by_sym.get(s) or []) >= 4
+                for q in inc_by_sym[s][:4]]
+        q = pd.DataFrame(flat, columns=["symbol", "operatingIncome"])
+        ebit = num(q["operatingIncome"]).fillna(0).groupby(q["symbol"]).sum().reindex(syms)
+
+    mcap = num(prof["mktCap"].where(prof["mktCap"].notna(), prof["marketCap"]))
+    tca, tcl = bal["totalCurrentAssets"], bal["totalCurrentLiabilities"]
+    ppe, cash = bal["propertyPlantEquipmentNet"], bal["cashAndShortTermInvestments"]
+    debt = bal["totalDebt"].fillna(bal["shortTermDebt"]).fillna(bal["longTermDebt"]).fillna(0.0)
+
+    ev = mcap + debt - cash
+    nwc = ((tca - cash) - (tcl - debt)).clip(lower=0)
+    goodwill = bal["goodwill"].fillna(0.0) if include_goodwill else pd.Series(0.0, index=syms)
+    intangibles = bal["intangibleAssets"].fillna(0.0) if include_intangibles else pd.Series(0.0, index=syms)
+    capital = nwc + ppe + goodwill + intangibles
+    ey = ebit / ev
+    roc = ebit / capital
+
+    required = pd.DataFrame({"ebit": ebit, "tca": tca, "tcl": tcl, "ppe": ppe, "cash": cash, "mcap": mcap})
+    isna = required.isna()
+    incomplete = isna.any(axis=1)
+
+    # same order of checks as _compute_mf_metrics; the first one that fires is the reason
+    conds = [incomplete, ev <= 0, ev < mcap * 0.01, capital <= 0, capital < 10e6, ebit < 0, roc > 10.0]
+    labels = ["", "Negative or zero EV", "EV implausibly small vs market cap (data error)",
+              "Negative or zero capital", "Capital < $10M", "Negative EBIT", "ROC > 1000% (data error)"]
+    reason = pd.Series(np.select([c.to_numpy(dtype=bool) for c in conds], labels, default=""),
+                       index=syms, dtype=object)
+    for sym, row in isna[incomplete].iterrows():
+        reason[sym] = "Missing fields: " + ", ".join(row.index[row])
+    reason = reason.where(reason != "", None)
+
+    def present(col):
+        return col.where(col.notna() & (col != ""))
+    name = present(prof["companyName"]).fillna(present(prof["company"])).fillna(prof["symbol"]).fillna("")
+    prof = prof.astype(object).where(prof.notna(), None)
+    return pd.DataFrame({
+        "name":      name,
+        "exchange":  prof["exchangeShortName"],
+        "country":   prof["country"],
+        "sector":    prof["sector"],
+        "industry":  prof["industry"],
+        "marketCap": mcap,
+        "EV":        ev,
+        "EBIT":      ebit,
+        "NWC":       nwc,
+        "PPE_Net":   ppe,
+        "Capital":   capital,
+        "Cash":      cash,
+        "TotalDebt": debt,
+        "EY":        ey,
+        "ROC":       roc,
+        "Goodwill":  goodwill,
+        "Intangibles": intangibles,
+        "reason":    reason,
+    }, index=syms)
+
 def _compute_z_score(prof: dict, inc: list, bal: list) -> Optional[float]:
     """Altman Z-score (public company version)."""
     try:
@@ -376,9 +703,11 @@ def _compute_z_score(prof: dict, inc: list, bal: list) -> Optional[float]:
         ca   = b.get("totalCurrentAssets") or 0
         cl   = b.get("totalCurrentLiabilities") or 0
         re   = b.get("retainedEarnings") or 0
-        mcap = float(prof.get("mktCap") or prof.get("marketCap") or 0)
-        ebit = _latest(inc, "operatingIncome") or 0
-        rev  = _latest(inc, "revenue") or 0
+        mcap = _market_cap(prof)
+        mcap = 0.0 if np.isnan(mcap) else mcap
+        i    = inc[0] if inc else {}
+        ebit = _num(i, "operatingIncome") or 0
+        rev  = _num(i, "revenue") or 0
 
         if ta <= 0 or tl <= 0:
             return None
@@ -446,54 +775,128 @@ def _compute_f_score(inc: list, bal: list, cf: list) -> Optional[int]:
         print(f"[_compute_f_score] {type(e).__name__}: {e}", flush=True)
         return None
 
+def compute_company(symbol: str, prof: dict, inc: list, bal: list, annual: bool = False,
+                    include_goodwill: bool = False, include_intangibles: bool = False,
+                    compute_z: bool = False, compute_f: bool = False, cf=None,
+                    metrics: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Build a company record from already-fetched profile and statements.
+    cf is the cash-flow list, or a callable returning it, so it is only fetched once the
+    company has passed the MF filters and the F-score is actually wanted.
+    metrics is an already computed _compute_mf_metrics result (the bulk path passes its
+    _mf_metrics_frame row) and skips that step.
+    Returns a success/skip record, or None if the metrics could not be computed.
+    """
+    result = metrics if metrics is not None else \
+        _compute_mf_metrics(prof, inc, bal, annual, include_goodwill, include_intangibles)
+    if result is None:
+        return None
+    if "reason" in result:
+        return {"type": "skip", "ticker": symbol, "name": prof.get("companyName") or symbol,
+                "reason": result["reason"]}
+
+    if compute_z:
+        result["ZScore"] = _compute_z_score(prof, inc, bal)
+    if compute_f:
+        result["FScore"] = _compute_f_score(inc, bal, (cf() if callable(cf) else cf) or [])
+    return {"type": "success", "ticker": symbol, **result}
+
 def pull_company(symbol: str, annual: bool = False, include_goodwill: bool = False,
                  include_intangibles: bool = False, compute_z: bool = False,
-                 compute_f: bool = False, api_key: str = None) -> Optional[Dict[str, Any]]:
+                 compute_f: bool = False, api_key: str = None,
+                 min_mcap: float = 0, prof: Optional[dict] = None,
+                 history_quarters: int = 0) -> Optional[Dict[str, Any]]:
+    """
+    Fetch and compute one company. prof may be the symbol's /stock-screener row, which carries
+    the same name/sector/industry/marketCap fields as /profile and saves that call.
+    history_quarters widens the quarterly income/balance requests to what the debt/revenue
+    health check asks for, so that check is later served from http_cache instead of the API.
+    """
     try:
-        prof = fmp_profile(symbol, api_key=api_key)
+        if not prof:
+            prof = fmp_profile(symbol, api_key=api_key)
         if not prof:
             return {"type": "skip", "ticker": symbol, "name": symbol, "reason": "No profile data"}
 
-        inc = fmp_income(symbol, annual, api_key=api_key)
-        bal = fmp_balance(symbol, api_key=api_key)
-
-        result = _compute_mf_metrics(prof, inc, bal, annual, include_goodwill, include_intangibles)
-
-        if result and "reason" not in result:
-            if compute_z:
-                result["ZScore"] = _compute_z_score(prof, inc, bal)
-        #        if result["ZScore"] is not None and result["ZScore"] < 2.99:
-        #            return {"type": "skip", "ticker": symbol, "name": prof.get("companyName", symbol),
-        #                    "reason": f"Z-score {result['ZScore']} below 2.99"}
-            if compute_f:
-                cf = None
-                conn = get_conn()
-                row = conn.execute(
-                    "SELECT json_blob FROM raw_json_vault WHERE ticker = ? AND endpoint = 'cash-flow-statement'",
-                    (symbol,)
-                ).fetchone()
-                conn.close()
-                if row:
-                    cf = json.loads(row[0])
-                else:
-                    cf = fmp_cashflow(symbol, annual, api_key=api_key)
-                result["FScore"] = _compute_f_score(inc, bal, cf)
-        #       if result["FScore"] is None or result["FScore"] < 3:
-        #            return {"type": "skip", "ticker": symbol, "name": prof.get("companyName", symbol),
-        #                    "reason": f"F-score {result['FScore']} below 3"}
-
-        if result is None:
+        # Settle everything the profile alone decides before spending two more
+        # calls on statements for a company that will be dropped anyway.
+        if _is_excluded(prof):
+            return None
+        if min_mcap and not _market_cap(prof) >= min_mcap:  # NaN (unknown cap) fails too
             return None
-        if "reason" in result:
-            print(f"DEBUG: Skipping {symbol} -> {result['reason']}")
-            return {"type": "skip", "ticker": symbol, "name": prof.get("companyName", symbol),
-                    "reason": result["reason"]}
 
-        return {"type": "success", "ticker": symbol, **result}
+        inc = fmp_income(symbol, annual, api_key=api_key, limit=max(4, history_quarters))[:2 if annual else 4]
+        bal = fmp_balance(symbol, api_key=api_key, limit=max(2, history_quarters))[:2]
+
+        def cashflow():
+            conn = get_conn()
+            row = conn.execute(
+                "SELECT json_blob FROM raw_json_vault WHERE ticker = ? AND endpoint = 'cash-flow-statement'",
+                (symbol,)
+            ).fetchone()
+            conn.close()
+            if row:
+                return _json_loads(row[0])
+            return fmp_cashflow(symbol, annual, api_key=api_key)
+
+        rec = compute_company(symbol, prof, inc, bal, annual, include_goodwill, include_intangibles,
+                              compute_z=compute_z, compute_f=compute_f, cf=cashflow)
+        if rec and rec["type"] == "skip":
+            log.debug("Skipping %s -> %s", symbol, rec["reason"])
+        return rec
 
     except Exception as e:
         return {"type": "skip", "ticker": symbol, "name": symbol, "reason": f"Exception: {str(e)}"}
 
+def _bulk_gap(rec: Optional[Dict[str, Any]]) -> bool:
+    """A bulk skip that may only mean the downloaded files don't cover the symbol; worth a per-symbol retry."""
+    return bool(rec) and rec.get("type") == "skip" and \
+        (rec.get("reason") == "No profile data" or str(rec.get("reason", "")).startswith("Missing fields"))
+
+def pull_company_bulk(symbols: List[str], annual: bool = False, include_goodwill: bool = False,
+                      include_intangibles: bool = False, compute_z: bool = False,
+                      compute_f: bool = False, api_key: str = None,
+                      profiles: Optional[Dict[str, dict]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Bulk counterpart of pull_company: a handful of v4 bulk downloads (profile, income,
+    balance, optionally cash flow) instead of 2-3 requests per symbol.
+    profiles ({symbol: screener row}) replaces the profile download when given.
+    Returns {symbol: record} with the same success/skip records as pull_company, and
+    caches them (company_cache / skip_cache) like fetch_company_with_cache does, except
+    coverage-gap skips (_bulk_gap), which callers retry per symbol.
+    Raises if the bulk endpoints are unavailable so callers can fall back.
+    """
+    wanted = set(symbols)
+    if profiles is None:
+        profiles = fmp_bulk_profiles(wanted, api_key=api_key)
+    inc_by_sym = fmp_bulk_income(wanted, annual, api_key=api_key)
+    bal_by_sym = fmp_bulk_balance(wanted, api_key=api_key)
+    cf_by_sym = fmp_bulk_cashflow(wanted, annual, api_key=api_key) if compute_f else {}
+
+    cache_period = _cache_period(annual, include_goodwill, include_intangibles, compute_z, compute_f)
+    out: Dict[str, Dict[str, Any]] = {}
+    for symbol in symbols:
+        if not profiles.get(symbol):
+            out[symbol] = {"type": "skip", "ticker": symbol, "name": symbol, "reason": "No profile data"}
+
+    metrics = _mf_metrics_frame(symbols, profiles, inc_by_sym, bal_by_sym, annual,
+                                include_goodwill, include_intangibles)
+    for symbol, result in zip(metrics.index, metrics.to_dict(orient="records")):
+        reason = result.pop("reason")
+        try:
+            rec = compute_company(symbol, profiles[symbol], inc_by_sym.get(symbol, [])[:2 if annual else 4],
+                                  bal_by_sym.get(symbol, [])[:2], annual, include_goodwill, include_intangibles,
+                                  compute_z=compute_z, compute_f=compute_f,
+                                  cf=cf_by_sym.get(symbol, [])[:2 if annual else 8],
+                                  metrics={"reason": reason} if reason is not None else result)
+        except Exception as e:
+            rec = {"type": "skip", "ticker": symbol, "name": symbol, "reason": f"Exception: {str(e)}"}
+        if rec["type"] == "success":
+            db_upsert(rec, cache_period)
+        out[symbol] = rec
+    db_upsert_skips((rec for rec in out.values() if not _bulk_gap(rec)), cache_period)
+    return out
+
 #---------------------compute from vault----------------
 def compute_mf_from_vault(symbol: str, vault: dict, annual: bool = True) -> Optional[Dict[str, Any]]:
     """
@@ -573,6 +976,30 @@ def _init_db():
                 PRIMARY KEY (ticker, endpoint)
             )
         """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS symbol_cache (
+            exchange TEXT PRIMARY KEY,
+            json_blob TEXT NOT NULL,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS skip_cache (
+            ticker TEXT NOT NULL,
+            period TEXT NOT NULL,
+            name TEXT,
+            reason TEXT NOT NULL,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (ticker, period)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS http_cache (
+            url TEXT PRIMARY KEY,
+            json_blob TEXT NOT NULL,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
     conn.execute("""
         CREATE TABLE IF NOT EXISTS scan_control (
             key   TEXT PRIMARY KEY,
@@ -594,6 +1021,34 @@ def _init_db():
 # Initialize database on module load
 _init_db()
 
+def http_cache_get(key: str, max_age_days: float) -> Optional[Any]:
+    """Return a cached fmp_get response (path + params, no API key) if newer than max_age_days."""
+    conn = get_conn()
+    row = conn.execute(
+        "SELECT json_blob FROM http_cache WHERE url = ? AND last_updated >= datetime('now', ?)",
+        (key, f"-{max_age_days} days")
+    ).fetchone()
+    conn.close()
+    return _json_loads(row[0]) if row else None
+
+def http_cache_put(key: str, data: Any) -> None:
+    conn = get_conn()
+    conn.execute(
+        "INSERT OR REPLACE INTO http_cache (url, json_blob, last_updated) VALUES (?, ?, CURRENT_TIMESTAMP)",
+        (key, _json_dumps(data))
+    )
+    conn.commit()
+    conn.close()
+
+def purge_http_cache(max_age_days: float = HTTP_CACHE_DAYS) -> int:
+    """Delete expired http_cache rows; returns how many were removed."""
+    conn = get_conn()
+    n = conn.execute("DELETE FROM http_cache WHERE last_updated < datetime('now', ?)",
+                     (f"-{max_age_days} days",)).rowcount
+    conn.commit()
+    conn.close()
+    return n
+
 def db_upsert(record: Dict[str, Any], period: str) -> None:
     """Insert or update a company record in the database."""
     if not record or record.get("type") != "success":
@@ -656,6 +1111,29 @@ def db_upsert(record: Dict[str, Any], period: str) -> None:
 
 
 
+def _cached_record(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "type": "success",
+        "ticker": row["ticker"],
+        "name": row["name"],
+        "exchange": row["exchange"],
+        "country": row["country"],
+        "sector": row["sector"],
+        "industry": row["industry"],
+        "marketCap": row["marketCap"],
+        "EV": row["EV"],
+        "EBIT": row["EBIT"],
+        "NWC": row["NWC"],
+        "PPE_Net": row["PPE_Net"],
+        "Capital": row["Capital"],
+        "Cash": row["Cash"],
+        "TotalDebt": row["TotalDebt"],
+        "EY": row["EY"],
+        "ROC": row["ROC"],
+        "ZScore": row["ZScore"],
+        "FScore": row["FScore"],
+    }
+
 def db_fetch(ticker: str, period: str, max_age_days: int = 7) -> Optional[Dict[str, Any]]:
     """Fetch a cached company record if it exists and is not expired."""
     conn = get_conn()
@@ -668,29 +1146,55 @@ def db_fetch(ticker: str, period: str, max_age_days: int = 7) -> Optional[Dict[s
     conn.close()
 
     if row:
-        return {
-            "type": "success",
-            "ticker": row["ticker"],
-            "name": row["name"],
-            "exchange": row["exchange"],
-            "country": row["country"],
-            "sector": row["sector"],
-            "industry": row["industry"],
-            "marketCap": row["marketCap"],
-            "EV": row["EV"],
-            "EBIT": row["EBIT"],
-            "NWC": row["NWC"],
-            "PPE_Net": row["PPE_Net"],
-            "Capital": row["Capital"],
-            "Cash": row["Cash"],
-            "TotalDebt": row["TotalDebt"],
-            "EY": row["EY"],
-            "ROC": row["ROC"],
-            "ZScore": row["ZScore"],
-            "FScore": row["FScore"],
-        }
+        return _cached_record(row)
     return None
 
+def db_fetch_many(tickers: List[str], period: str, max_age_days: int = 7) -> Dict[str, Dict[str, Any]]:
+    """
+    db_fetch for many tickers in a few IN (...) queries; returns {ticker: record} for the fresh hits,
+    including cached skip records so companies that failed a filter aren't fetched again.
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    conn = get_conn()
+    try:
+        for i in range(0, len(tickers), 500):  # stay under SQLite's bound-parameter limit
+            chunk = tickers[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(f"""
+                SELECT ticker, name, reason FROM skip_cache
+                WHERE period = ? AND ticker IN ({marks})
+                AND last_updated > datetime('now', ?)
+            """, (period, *chunk, f'-{max_age_days} days')).fetchall()
+            out.update((row["ticker"], {"type": "skip", "ticker": row["ticker"], "name": row["name"],
+                                        "reason": row["reason"]}) for row in rows)
+            rows = conn.execute(f"""
+                SELECT * FROM company_cache
+                WHERE period = ? AND ticker IN ({marks})
+                AND last_updated > datetime('now', ?)
+            """, (period, *chunk, f'-{max_age_days} days')).fetchall()
+            out.update((row["ticker"], _cached_record(row)) for row in rows)
+    finally:
+        conn.close()
+    return out
+
+def _cacheable_skip(rec: Optional[Dict[str, Any]]) -> bool:
+    # data-driven skips only; exceptions and missing profiles may be transient
+    return bool(rec) and rec.get("type") == "skip" and rec.get("reason") != "No profile data" \
+        and not str(rec.get("reason", "")).startswith("Exception")
+
+def db_upsert_skips(records: Iterable[Dict[str, Any]], period: str) -> None:
+    """Remember skip records (see _cacheable_skip) for the same max age as company_cache."""
+    rows = [(r["ticker"], period, r.get("name"), r["reason"]) for r in records if _cacheable_skip(r)]
+    if not rows:
+        return
+    conn = get_conn()
+    conn.executemany("""
+        INSERT OR REPLACE INTO skip_cache (ticker, period, name, reason, last_updated)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """, rows)
+    conn.commit()
+    conn.close()
+
 
 def _set_deepscan_pause(paused: bool) -> None:
     conn = get_conn()
@@ -702,10 +1206,9 @@ def _set_deepscan_pause(paused: bool) -> None:
     conn.close()
 
 
-def fetch_company_with_cache(symbol: str, annual: bool = False, include_goodwill: bool = False,
-                             include_intangibles: bool = False, compute_z: bool = False,
-                             compute_f: bool = False, api_key: str = None) -> Optional[Dict[str, Any]]:
-
+def _cache_period(annual: bool, include_goodwill: bool, include_intangibles: bool,
+                  compute_z: bool, compute_f: bool) -> str:
+    """company_cache period key — one row per ticker per distinct set of calc options."""
     period = "annual" if annual else "ttm"
     if include_goodwill:
         period += "_g"
@@ -715,26 +1218,62 @@ def fetch_company_with_cache(symbol: str, annual: bool = False, include_goodwill
         period += "_z"
     if compute_f:
         period += "_f"
+    return period
+
+
+def fetch_company_with_cache(symbol: str, annual: bool = False, include_goodwill: bool = False,
+                             include_intangibles: bool = False, compute_z: bool = False,
+                             compute_f: bool = False, api_key: str = None,
+                             max_age_days: int = 7, min_mcap: float = 0,
+                             prof: Optional[dict] = None, history_quarters: int = 0) -> Optional[Dict[str, Any]]:
+
+    period = _cache_period(annual, include_goodwill, include_intangibles, compute_z, compute_f)
 
     # Try to fetch from cache first
-    cached = db_fetch(symbol, period)
+    cached = db_fetch(symbol, period, max_age_days)
     if cached:
         return cached
     rec = pull_company(symbol, annual, include_goodwill, include_intangibles,
-                       compute_z=compute_z, compute_f=compute_f, api_key=api_key)
-    # Cache successful records
+                       compute_z=compute_z, compute_f=compute_f, api_key=api_key,
+                       min_mcap=min_mcap, prof=prof, history_quarters=history_quarters)
+    # Cache successful records, and skips so the next scan doesn't refetch them
     if rec and rec.get("type") == "success":
         db_upsert(rec, period)
+    else:
+        db_upsert_skips([rec] if rec else [], period)
     return rec
 
 # -------------------- Ranking --------------------
 
+# Columns of a successful company record (see _compute_mf_metrics), in export order
+RECORD_COLS = [
+    "ticker", "name", "exchange", "country", "sector", "industry",
+    "marketCap", "EV", "EBIT", "NWC", "PPE_Net", "Capital", "Cash", "TotalDebt",
+    "EY", "ROC", "Goodwill", "Intangibles",
+]
+RECORD_NUMERIC_COLS = RECORD_COLS[6:]
+
+def records_frame(records: List[Dict[str, Any]], compute_z: bool = False, compute_f: bool = False) -> pd.DataFrame:
+    """DataFrame of company records with a fixed schema, skipping pandas' per-column type inference."""
+    cols = RECORD_COLS + (["ZScore"] if compute_z else []) + (["FScore"] if compute_f else [])
+    df = pd.DataFrame.from_records(records, columns=cols)
+    df[RECORD_NUMERIC_COLS] = df[RECORD_NUMERIC_COLS].astype("float64")
+    return df
+
+def _min_rank_desc(values: np.ndarray) -> np.ndarray:
+    """Descending rank with ties sharing the lowest rank (pandas rank(ascending=False, method="min"))."""
+    neg = -values
+    return np.searchsorted(np.sort(neg), neg, side="left") + 1.0
+
 def magic_formula_rank(df: pd.DataFrame) -> pd.DataFrame:
     df = df.dropna(subset=["EY", "ROC"]).copy()
-    df["EY_rank"] = df["EY"].rank(ascending=False, method="min")
-    df["ROC_rank"] = df["ROC"].rank(ascending=False, method="min")
-    df["MF_score"] = df["EY_rank"] + df["ROC_rank"]
-    return df.sort_values(["MF_score", "EY_rank", "ROC_rank"]) 
+    ey_rank = _min_rank_desc(df["EY"].to_numpy(dtype="float64"))
+    roc_rank = _min_rank_desc(df["ROC"].to_numpy(dtype="float64"))
+    df["EY_rank"] = ey_rank
+    df["ROC_rank"] = roc_rank
+    df["MF_score"] = ey_rank + roc_rank
+    # lexsort takes its primary key last
+    return df.iloc[np.lexsort((roc_rank, ey_rank, ey_rank + roc_rank))]
 
 # -------------------- CLI --------------------
 
@@ -749,13 +1288,14 @@ def main():
                     help="Comma‑separated FMP exchange codes (e.g., NASDAQ,NYSE,LSE)")
     ap.add_argument("--min-mcap", type=float, default=50e6, help="Minimum market cap USD")
     ap.add_argument("--limit", type=int, default=400, help="Max symbols to process (free‑tier friendly); web UI defaults to 4000 to cover the full NASDAQ+NYSE+AMEX universe")
-    ap.add_argument("--sleep", type=float, default=0.2, help="Delay between API calls to respect rate limits")
+    ap.add_argument("--sleep", type=float, default=0.2,
+                    help="Ignored; kept for old scripts. Request pacing is handled by the shared rate limiter")
     ap.add_argument("--top", type=int, default=30, help="How many top results to export")
     ap.add_argument("--no-random", action="store_true", default=False, help="Disable symbol shuffling (default: shuffle, matching web UI)")
     ap.add_argument("--countries", type=str, default=None,
                 help="Comma-separated country codes (e.g., US,CA,GB). Default: US")
     ap.add_argument("--tier1", action="store_true",
-                help="Use Tier 1 markets: US, SG, GB, CA")
+                help="Use Tier 1 markets: " + ", ".join(code for _, code in COUNTRY_TIERS["Tier 1"]))
     ap.add_argument("--out", type=str, default=default_name, help="Output CSV path")
     ap.add_argument("--annual", action="store_true",
                 help="Use annual data instead of TTM quarterly")
@@ -775,29 +1315,39 @@ def main():
                     help="Include intangibles in capital calculation")
     ap.add_argument("--zscore", action="store_true", help="Compute and output Altman Z-score")
     ap.add_argument("--fscore", action="store_true", help="Compute and output Piotroski F-score")
+    ap.add_argument("--debug", action="store_true", help="Log every skipped symbol and its reason")
 
     args = ap.parse_args()
+    # root stays at WARNING: urllib3's DEBUG request lines would print the apikey query param
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    if args.debug:
+        log.setLevel(logging.DEBUG)
 
  # Parse countries
     if args.tier1:
-        countries = ["US", "SG", "GB", "CA"]
+        countries = frozenset(code for _, code in COUNTRY_TIERS["Tier 1"])
     elif args.countries:
-        countries = [c.strip() for c in args.countries.split(',')]
+        countries = frozenset(c.strip() for c in args.countries.split(','))
     else:
-        countries = ["US"]  # matches web UI default; use --countries or --tier1 to override
+        countries = frozenset({"US"})  # matches web UI default; use --countries or --tier1 to override
 
  
     exchanges = [x.strip() for x in args.exchanges.split(',') if x.strip()]
 
+    purge_http_cache()
+
     # Pull symbols per exchange
+    # (independent screener calls, so fetch them side by side; map keeps exchange order)
     symbols: List[str] = []
-    for ex in exchanges:
-        rows = list_symbols(ex, args.min_mcap, countries)
+    screener: Dict[str, Dict[str, Any]] = {}  # symbol -> screener row, stands in for /profile
+    with ThreadPoolExecutor(max_workers=max(len(exchanges), 1)) as executor:
+        per_exchange = list(executor.map(lambda ex: list_symbols(ex, args.min_mcap, countries), exchanges))
+    for rows in per_exchange:
         for r in rows:
             sym = r.get("symbol") or r.get("displaySymbol")
             if sym:
                 symbols.append(sym)
-        time.sleep(args.sleep)
+                screener.setdefault(sym, r)
 
     # Dedup (filtering already done in list_symbols)
     symbols = list(dict.fromkeys(symbols))
@@ -814,27 +1364,62 @@ def main():
 
     records = []
     skipped = []
+
+    def collect(rec):
+        if not rec:
+            return
+        if rec.get("type") == "success" and rec.get("marketCap", 0) >= args.min_mcap:
+            records.append(rec)
+        elif rec.get("type") == "skip":
+            skipped.append({
+                "ticker": rec.get("ticker"),
+                "name": rec.get("name", ""),
+                "reason": rec.get("reason", "Unknown")
+            })
+
     _set_deepscan_pause(True)
     try:
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            futures = {executor.submit(fetch_company_with_cache, sym, args.annual, args.include_goodwill,
-                                       args.include_intangibles, args.zscore, args.fscore): sym for sym in symbols}
-            for future in tqdm(as_completed(futures), total=len(futures), desc="Pulling fundamentals"):
-                try:
-                    rec = future.result(timeout=5)
-                    if rec:
-                        if rec.get("type") == "success" and rec.get("marketCap", 0) >= args.min_mcap:
-                            records.append(rec)
-                        elif rec.get("type") == "skip":
-                            skipped.append({
-                                "ticker": rec.get("ticker"),
-                                "name": rec.get("name", ""),
-                                "reason": rec.get("reason", "Unknown")
-                            })
-                except TimeoutError:
-                    print(f"[main] {futures[future]}: timeout (worker exceeded 5s)", flush=True)
-                except Exception as e:
-                    print(f"[main] {futures[future]}: {type(e).__name__}: {e}", flush=True)
+        # Fresh cached records (successes and skips) in one batched query; only the misses touch the API
+        period = _cache_period(args.annual, args.include_goodwill, args.include_intangibles,
+                               args.zscore, args.fscore)
+        cached = db_fetch_many(symbols, period)
+        for sym in symbols:
+            collect(cached.get(sym))
+        to_fetch = [sym for sym in symbols if sym not in cached]
+        print(f"{len(cached)} cached, {len(to_fetch)} to fetch")
+
+        # Bulk endpoints first (one download per statement type); plans without
+        # bulk access raise and we fall back to per-symbol requests.
+        bulk = None
+        if to_fetch:
+            try:
+                bulk = pull_company_bulk(to_fetch, args.annual, args.include_goodwill,
+                                         args.include_intangibles, args.zscore, args.fscore,
+                                         profiles=screener)
+            except Exception as e:
+                print(f"[main] bulk fetch unavailable, using per-symbol requests: {type(e).__name__}: {e}", flush=True)
+
+        if bulk is not None:
+            for sym in to_fetch:
+                if not _bulk_gap(bulk.get(sym)):
+                    collect(bulk.get(sym))
+            # symbols the bulk files didn't fully cover get a per-symbol retry
+            to_fetch = [sym for sym in to_fetch if _bulk_gap(bulk.get(sym))]
+        if to_fetch:
+            # fetch the debt/revenue check's quarters up front so the health stage reuses them
+            history = (args.debt_revenue_quarters
+                       if (args.check_debt_revenue or args.health_checks) and not args.annual else 0)
+            with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+                futures = {executor.submit(fetch_company_with_cache, sym, args.annual, args.include_goodwill,
+                                           args.include_intangibles, args.zscore, args.fscore,
+                                           min_mcap=args.min_mcap, prof=screener.get(sym),
+                                           history_quarters=history): sym
+                           for sym in to_fetch}
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Pulling fundamentals"):
+                    try:
+                        collect(future.result())  # already done — as_completed only yields finished futures
+                    except Exception as e:
+                        print(f"[main] {futures[future]}: {type(e).__name__}: {e}", flush=True)
     finally:
         _set_deepscan_pause(False)
 
@@ -842,7 +1427,7 @@ def main():
         print("No qualifying records. Try increasing --limit or lowering --min-mcap.")
         return
 
-    df = pd.DataFrame(records)
+    df = records_frame(records, args.zscore, args.fscore)
     ranked = magic_formula_rank(df)
 
     # Apply health checks only to top candidates
@@ -850,18 +1435,16 @@ def main():
     check_cashflow = args.check_cashflow or args.health_checks
     if check_debt_revenue or check_cashflow:
         top_candidates = ranked.head(args.top)
-        healthy_tickers = []
-
-        for ticker in tqdm(top_candidates["ticker"], desc="Running health checks"):
-            health = check_financial_health(
-                ticker,
-                check_debt_revenue=check_debt_revenue,
-                check_cashflow_quality=check_cashflow,
-                debt_revenue_quarters=args.debt_revenue_quarters,
-                cashflow_quarters=args.cashflow_quarters,
-            )
-            if health["passes_all"]:
-                healthy_tickers.append(ticker)
+        print(f"Running health checks on top {len(top_candidates)} candidates...")
+        health_data = fetch_health_data_many(
+            list(top_candidates["ticker"]),
+            check_debt_revenue=check_debt_revenue,
+            check_cashflow_quality=check_cashflow,
+            debt_revenue_quarters=args.debt_revenue_quarters,
+            cashflow_quarters=args.cashflow_quarters,
+        )
+        health = evaluate_health_many(health_data, check_debt_revenue, check_cashflow)
+        healthy_tickers = {ticker for ticker, h in health.items() if h["passes_all"]}
 
         ranked = ranked[ranked["ticker"].isin(healthy_tickers)]
         print(f"Health checks: {len(healthy_tickers)}/{len(top_candidates)} passed")
@@ -875,17 +1458,22 @@ def main():
     cols = [c for c in cols if c in ranked.columns]
 
     out = ranked[cols].head(args.top)
-    out.to_csv(args.out, index=False)
+    out.to_csv(args.out, index=False, lineterminator="\n")
     
 # Save skipped stocks to separate CSV
     if skipped:
         skipped_file = args.out.replace(".csv", "_skipped.csv")
         skipped_df = pd.DataFrame(skipped)
-        skipped_df.to_csv(skipped_file, index=False)
+        skipped_df.to_csv(skipped_file, index=False, lineterminator="\n")
         print(f"\nSkipped {len(skipped)} stocks (saved to: {skipped_file})")
+        for reason, n in skipped_df["reason"].value_counts().head(10).items():
+            print(f"  {n:>6}  {reason}")
 
     print("Top results saved to:", args.out)
-    print(out.to_string(index=False, max_colwidth=28))
+    # the CSV has everything; the console only needs a readable preview
+    print(out.head(30).to_string(index=False, max_colwidth=28))
+    if len(out) > 30:
+        print(f"... {len(out) - 30} more rows in {args.out}")
  
     elapsed = time.time() - start_time
     minutes, seconds = divmod(int(elapsed), 60)
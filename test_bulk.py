@@ -0,0 +1,135 @@
+"""
+test_bulk.py
+
+Standalone check that the bulk fetch path (pull_company_bulk) and the
+per-symbol path (pull_company) turn the same statements into the same
+company records. Both write the same company_cache key, so a record must
+not depend on whether the API key's plan has bulk access.
+
+FMP is never called: fmp_get / fmp_get_bulk are replaced with fakes that
+serve one set of synthetic statements, and the cache goes to a throwaway
+DB so your real cache.db is untouched.
+
+Usage:
+    python3 test_bulk.py
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import magicformula as mf
+
+SYMBOLS = [f"T{i}" for i in range(12)]
+YEAR = mf.datetime.date.today().year
+
+
+def make_statements():
+    """Annual + quarterly income/cash flow and quarterly + annual balance sheets per symbol."""
+    rng = random.Random(7)
+    stmts = {"income-statement": [], "balance-sheet-statement": [], "cash-flow-statement": []}
+    for sym in SYMBOLS:
+        dates = [(f"{YEAR - 1 - y}-12-31", "FY") for y in range(3)]
+        dates += [(f"{YEAR - 1 - q // 4}-{12 - 3 * (q % 4):02d}-28", f"Q{4 - q % 4}") for q in range(10)]
+        for date, period in dates:
+            scale = 4 if period == "FY" else 1
+            row = {"symbol": sym, "date": date, "period": period}
+            stmts["income-statement"].append(dict(row,
+                operatingIncome=rng.uniform(5e6, 60e6) * scale, revenue=rng.uniform(1e8, 5e8) * scale,
+                costOfRevenue=rng.uniform(5e7, 9e7) * scale, netIncome=rng.uniform(1e6, 40e6) * scale))
+            stmts["balance-sheet-statement"].append(dict(row,
+                totalCurrentAssets=rng.uniform(1e8, 3e8), totalCurrentLiabilities=rng.uniform(5e7, 2e8),
+                propertyPlantEquipmentNet=rng.uniform(5e7, 2e8), cashAndShortTermInvestments=rng.uniform(1e7, 8e7),
+                totalDebt=rng.uniform(0, 1e8), longTermDebt=rng.uniform(0, 8e7), goodwill=rng.uniform(0, 5e7),
+                intangibleAssets=rng.uniform(0, 3e7), totalAssets=rng.uniform(5e8, 9e8),
+                totalLiabilities=rng.uniform(2e8, 4e8), retainedEarnings=rng.uniform(-5e7, 3e8),
+                commonStock=rng.uniform(1e6, 5e6)))
+            stmts["cash-flow-statement"].append(dict(row,
+                operatingCashFlow=rng.uniform(1e6, 60e6) * scale, netIncome=rng.uniform(1e6, 40e6) * scale))
+    for row in stmts["income-statement"]:
+        if row["symbol"] == SYMBOLS[-1]:  # one company both paths must skip
+            row["operatingIncome"] = -row["operatingIncome"]
+    for rows in stmts.values():
+        rows.sort(key=lambda r: r["date"], reverse=True)
+    return stmts
+
+
+def screener_rows():
+    return {sym: {"symbol": sym, "companyName": f"{sym} Corp", "marketCap": 2e9 + i * 1e8,
+                  "sector": "Technology", "industry": "Software", "exchangeShortName": "NASDAQ",
+                  "country": "US"}
+            for i, sym in enumerate(SYMBOLS)}
+
+
+def install_fakes(stmts):
+    def wanted_period(row, period):
+        return (row["period"] == "FY") == (period == "annual")
+
+    def fake_get(path, params=None, api_key=None, cache_days=None):
+        endpoint, sym = path.strip("/").split("/")
+        rows = [r for r in stmts[endpoint] if r["symbol"] == sym and wanted_period(r, params["period"])]
+        return [dict(r) for r in rows[:params["limit"]]]
+
+    def fake_get_bulk(path, params=None, api_key=None, wanted=None):
+        endpoint = path.strip("/")[:-len("-bulk")]
+        return [dict(r) for r in stmts[endpoint]
+                if r["date"].startswith(str(params["year"])) and wanted_period(r, params["period"])
+                and (wanted is None or r["symbol"] in wanted)]
+
+    mf.fmp_get = fake_get
+    mf.fmp_get_bulk = fake_get_bulk
+
+
+def same(a, b):
+    if a.keys() != b.keys():
+        return False
+    for k in a:
+        x, y = a[k], b[k]
+        if isinstance(x, float) and isinstance(y, float):
+            if not abs(x - y) <= 1e-9 * max(abs(x), abs(y), 1.0):
+                return False
+        elif x != y:
+            return False
+    return True
+
+
+def main():
+    real_db = mf.DB_PATH
+    tmp_dir = tempfile.mkdtemp(prefix="bulk_test_")
+    mf.DB_PATH = os.path.join(tmp_dir, "test_cache.db")
+    mf._init_db()
+    real_get, real_get_bulk = mf.fmp_get, mf.fmp_get_bulk
+    install_fakes(make_statements())
+    profiles = screener_rows()
+
+    ok = True
+    try:
+        for annual in (True, False):
+            for opts in ((False, False, False, False), (True, True, True, True)):
+                bulk = mf.pull_company_bulk(SYMBOLS, annual, *opts, profiles=profiles)
+                for sym in SYMBOLS:
+                    one = mf.pull_company(sym, annual, *opts, prof=profiles[sym])
+                    expected = "skip" if sym == SYMBOLS[-1] else "success"
+                    assert one is not None and one["type"] == expected, (sym, one)
+                    assert same(bulk[sym], one), f"{sym} annual={annual} opts={opts}:\n  bulk {bulk[sym]}\n  per-symbol {one}"
+                print(f"[ok] annual={annual} goodwill/intangibles/z/f={opts}: {len(SYMBOLS)} records match")
+
+        print("\nALL CHECKS PASSED")
+
+    except Exception as e:
+        ok = False
+        print(f"\nFAILED: {type(e).__name__}: {e}")
+        raise
+    finally:
+        mf.fmp_get, mf.fmp_get_bulk = real_get, real_get_bulk
+        mf.DB_PATH = real_db
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        print(f"cleaned up {tmp_dir}")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()